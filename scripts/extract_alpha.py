@@ -5,117 +5,123 @@ These images are JPGs with a baked checkerboard background (common from generato
 We approximate alpha by keying out low-saturation grey background.
 
 Outputs cleaned RGBA PNG, cropped to content with padding, resized to 1024x1024.
+
+Needs NumPy and Pillow. Pillow-SIMD (a drop-in replacement) makes the resize,
+blur and unsharp passes several times faster:
+
+    pip uninstall pillow && CC="cc -mavx2" pip install -U --force-reinstall pillow-simd
+
+Building it against libjpeg-turbo also speeds up JPEG decode; with the library
+installed system-wide, force a source build so it gets linked:
+
+    pip install --no-binary :all: --force-reinstall pillow-simd
 """
 
+import multiprocessing
 import os
 import sys
-from PIL import Image, ImageFilter, ImageChops
-
-
-def clamp(x, a=0.0, b=1.0):
-    return a if x < a else b if x > b else x
-
-
-def rgb_to_hsv(r, g, b):
-    r, g, b = r / 255.0, g / 255.0, b / 255.0
-    mx = max(r, g, b)
-    mn = min(r, g, b)
-    d = mx - mn
-    if d == 0:
-        h = 0
-    elif mx == r:
-        h = ((g - b) / d) % 6
-    elif mx == g:
-        h = ((b - r) / d) + 2
-    else:
-        h = ((r - g) / d) + 4
-    h /= 6.0
-    s = 0 if mx == 0 else d / mx
-    v = mx
-    return h, s, v
-
-
-def make_alpha(im: Image.Image) -> Image.Image:
-    im = im.convert("RGB")
+
+import numpy as np
+from PIL import Image, ImageChops, ImageFilter, __version__ as PIL_VERSION, features
+
+
+# min squared RGB distance to a checker color (8-bit units) -> 8-bit alpha
+_DIST_LUT = (np.clip((np.sqrt(np.arange(3 * 255 * 255 + 1)) / 255.0 - 0.05) / 0.18, 0.0, 1.0) * 255).astype(np.uint8)
+
+# saturation 255 * d / mx, indexed [d, mx]
+# (column 0 is only ever read at d == 0, where it is 0)
+_SAT_LUT = np.minimum(255, np.arange(256)[:, None] * 255 // np.maximum(np.arange(256), 1)).astype(np.uint8)
+
+
+def _ramp(x, x0, k):
+    """8-bit alpha ``(x - x0) * k`` in Q16 fixed point, unclamped, as int32."""
+    return (x.astype(np.int32) * round(k * 65536) - round(x0 * k * 65536)) >> 16
+
+
+def _hsv_neutral(rgb):
+    """Saturation, value and neutrality planes of a uint8 RGB array.
+
+    S and V are 0..255. Neutrality is in 1/765 steps (765 for pure grey);
+    |r-g| + |g-b| + |b-r| is just twice the max-min spread.
+    """
+    # per-plane max/min; reducing over the 3-wide channel axis is far slower
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    v = np.maximum(np.maximum(r, g), b)
+    d = v - np.minimum(np.minimum(r, g), b)
+    s = _SAT_LUT[d, v]
+    neutral = 765 - 2 * d.astype(np.int16)
+    return s, v, neutral
+
+
+def _compute_alpha(im: Image.Image):
+    """Raw (unfeathered) uint8 alpha plane for an RGB image."""
     w, h = im.size
+    rgb = np.asarray(im)
+
+    s, v, neutral = _hsv_neutral(rgb)
 
     # Estimate checkerboard background colors by sampling low-sat pixels
-    px = im.load()
-    samples = []
+    # (s < 0.10, neutral > 0.75, v > 0.15)
     step = max(4, min(w, h) // 64)
-    for y in range(0, h, step):
-        for x in range(0, w, step):
-            r, g, b = px[x, y]
-            _, s, v = rgb_to_hsv(r, g, b)
-            neutral = 1.0 - (abs(r - g) + abs(g - b) + abs(b - r)) / (3.0 * 255.0)
-            if s < 0.10 and neutral > 0.75 and v > 0.15:
-                samples.append((r, g, b))
+    ss, vs, ns = s[::step, ::step], v[::step, ::step], neutral[::step, ::step]
+    samples = rgb[::step, ::step][(ss < 25.5) & (ns > 573.75) & (vs > 38.25)].astype(np.int64)
 
     # Fallback to corners if needed
     if len(samples) < 50:
         corners = [im.getpixel((2, 2)), im.getpixel((w - 3, 2)), im.getpixel((2, h - 3)), im.getpixel((w - 3, h - 3))]
-        samples = corners * 40
+        samples = np.tile(np.asarray(corners, np.int64), (40, 1))
 
     # crude 2-means clustering
-    c1 = samples[0]
-    c2 = samples[len(samples) // 2]
+    C = np.stack([samples[0], samples[len(samples) // 2]])
     for _ in range(8):
-        a1 = [0, 0, 0, 0]
-        a2 = [0, 0, 0, 0]
-        for r, g, b in samples:
-            d1 = (r - c1[0]) ** 2 + (g - c1[1]) ** 2 + (b - c1[2]) ** 2
-            d2 = (r - c2[0]) ** 2 + (g - c2[1]) ** 2 + (b - c2[2]) ** 2
-            if d1 <= d2:
-                a1[0] += r; a1[1] += g; a1[2] += b; a1[3] += 1
-            else:
-                a2[0] += r; a2[1] += g; a2[2] += b; a2[3] += 1
-        if a1[3] > 0:
-            c1 = (a1[0] // a1[3], a1[1] // a1[3], a1[2] // a1[3])
-        if a2[3] > 0:
-            c2 = (a2[0] // a2[3], a2[1] // a2[3], a2[2] // a2[3])
-
-    out = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-    opx = out.load()
+        D = ((samples[:, None, :] - C[None, :, :]) ** 2).sum(-1)
+        lbl = D.argmin(1)
+        for k in (0, 1):
+            members = samples[lbl == k]
+            if len(members):
+                C[k] = members.sum(0) // len(members)
+    c1, c2 = C
 
     # Alpha from: saturation + distance from either checker color + non-neutral bias
-    for y in range(h):
-        for x in range(w):
-            r, g, b = px[x, y]
-            _, s, v = rgb_to_hsv(r, g, b)
-            neutral = 1.0 - (abs(r - g) + abs(g - b) + abs(b - r)) / (3.0 * 255.0)
+    px = rgb.astype(np.int32)
+    d1 = ((px - c1.astype(np.int32)) ** 2).sum(-1)
+    d2 = ((px - c2.astype(np.int32)) ** 2).sum(-1)
 
-            d1 = (((r - c1[0]) / 255.0) ** 2 + ((g - c1[1]) / 255.0) ** 2 + ((b - c1[2]) / 255.0) ** 2) ** 0.5
-            d2 = (((r - c2[0]) / 255.0) ** 2 + ((g - c2[1]) / 255.0) ** 2 + ((b - c2[2]) / 255.0) ** 2) ** 0.5
-            dist = d1 if d1 < d2 else d2
+    # max of the candidates, accumulated in place in one int32 plane
+    a = _ramp(s, 0.08 * 255, 1 / 0.30)                              # keep color
+    np.maximum(a, _DIST_LUT[np.minimum(d1, d2)], out=a)             # foreground vs bg
+    np.maximum(a, _ramp(-neutral, -0.30 * 765, 255 / 229.5), out=a)  # non-neutral
+    np.maximum(a, _ramp(v, 0.80 * 255, 0.9 / 0.20), out=a)          # keep bright highlights
+    return np.clip(a, 0, 255).astype(np.uint8)
 
-            a = 0.0
-            a = max(a, (dist - 0.05) / 0.18)              # foreground vs bg
-            a = max(a, (s - 0.08) / 0.30)                 # keep color
-            a = max(a, (0.30 - neutral) / 0.30)           # non-neutral
-            a = max(a, (v - 0.80) / 0.20 * 0.9)           # keep bright highlights
 
-            a = clamp(a, 0.0, 1.0)
-            opx[x, y] = (r, g, b, int(a * 255))
+def make_alpha(im: Image.Image) -> tuple[Image.Image, np.ndarray]:
+    """Key out the checkerboard; returns ``(rgba_image, alpha_array)``."""
+    im = im if im.mode == "RGB" else im.convert("RGB")
+    alpha = Image.fromarray(_compute_alpha(im), "L")
 
     # Clean / sharpen alpha edges
-    alpha = out.split()[-1]
-    alpha = alpha.filter(ImageFilter.GaussianBlur(radius=0.6))
-    out.putalpha(alpha)
+    a = np.asarray(alpha.filter(ImageFilter.GaussianBlur(radius=0.6)))
+    out = Image.fromarray(np.dstack([np.asarray(im), a]), "RGBA")
 
     # Unsharp mask to counter resize blur
     out = out.filter(ImageFilter.UnsharpMask(radius=1.6, percent=120, threshold=3))
-    return out
+    return out, a
 
 
-def bbox_from_alpha(im: Image.Image, thresh=10):
-    a = im.split()[-1]
-    # getbbox on thresholded alpha
-    bw = a.point(lambda p: 255 if p > thresh else 0)
-    return bw.getbbox()
+def bbox_from_alpha(A, thresh=10):
+    # bounds of rows/cols where alpha exceeds thresh
+    rows = A.max(1) > thresh
+    cols = A.max(0) > thresh
+    if not rows.any():
+        return None
+    y0, y1 = int(rows.argmax()), len(rows) - int(rows[::-1].argmax())
+    x0, x1 = int(cols.argmax()), len(cols) - int(cols[::-1].argmax())
+    return (x0, y0, x1, y1)
 
 
-def crop_pad_resize(im: Image.Image, target=1024, pad_frac=0.14):
-    bb = bbox_from_alpha(im)
+def crop_pad_resize(im: Image.Image, alpha, target=1024, pad_frac=0.14):
+    bb = bbox_from_alpha(alpha)
     if not bb:
         return im.resize((target, target), Image.LANCZOS)
     x0, y0, x1, y1 = bb
@@ -126,13 +132,32 @@ def crop_pad_resize(im: Image.Image, target=1024, pad_frac=0.14):
     y0 = max(0, y0 - pad)
     x1 = min(im.width, x1 + pad)
     y1 = min(im.height, y1 + pad)
-    im = im.crop((x0, y0, x1, y1))
 
-    # letterbox to square
-    side = max(im.width, im.height)
-    sq = Image.new("RGBA", (side, side), (0, 0, 0, 0))
-    sq.paste(im, ((side - im.width) // 2, (side - im.height) // 2))
-    return sq.resize((target, target), Image.LANCZOS)
+    # letterbox to square: resample the crop box straight to its final size,
+    # then center it on a transparent target-sized canvas
+    side = max(x1 - x0, y1 - y0)
+    tw = max(1, round((x1 - x0) * target / side))
+    th = max(1, round((y1 - y0) * target / side))
+    scaled = im.resize((tw, th), Image.LANCZOS, box=(x0, y0, x1, y1))
+    out = Image.new("RGBA", (target, target), (0, 0, 0, 0))
+    out.paste(scaled, ((target - tw) // 2, (target - th) // 2))
+    return out
+
+
+def _save(im: Image.Image, out_path):
+    # zlib level 1: much faster than the default 6 for a modest size increase;
+    # run oxipng over the output afterwards if size matters
+    im.save(out_path, format="PNG", compress_level=1)
+    return out_path
+
+
+def _process_one(job):
+    out_dir, p = job
+    base = os.path.splitext(os.path.basename(p))[0]
+    im = Image.open(p)
+    rgba, alpha = make_alpha(im)
+    final = crop_pad_resize(rgba, alpha)
+    return _save(final, os.path.join(out_dir, base + ".png"))
 
 
 def main():
@@ -140,17 +165,25 @@ def main():
         print("usage: extract_alpha.py <out_dir> <in1> [in2...]")
         sys.exit(2)
 
+    # Pillow-SIMD tags its releases with a ".postN" suffix
+    if "post" not in PIL_VERSION:
+        print("note: stock Pillow %s detected; pillow-simd is faster" % PIL_VERSION, file=sys.stderr)
+    if not features.check_feature("libjpeg_turbo"):
+        print("note: Pillow is not linked against libjpeg-turbo; JPEG decode will be slower", file=sys.stderr)
+
     out_dir = sys.argv[1]
     os.makedirs(out_dir, exist_ok=True)
 
-    for p in sys.argv[2:]:
-        base = os.path.splitext(os.path.basename(p))[0]
-        im = Image.open(p)
-        rgba = make_alpha(im)
-        final = crop_pad_resize(rgba)
-        out_path = os.path.join(out_dir, base + ".png")
-        final.save(out_path)
-        print("wrote", out_path)
+    # Files are independent; fan them out across cores
+    jobs = [(out_dir, p) for p in sys.argv[2:]]
+    procs = min(len(jobs), os.cpu_count() or 1)
+    if procs == 1:
+        for job in jobs:
+            print("wrote", _process_one(job))
+        return
+    with multiprocessing.Pool(procs) as pool:
+        for out_path in pool.imap_unordered(_process_one, jobs):
+            print("wrote", out_path)
 
 
 if __name__ == "__main__":